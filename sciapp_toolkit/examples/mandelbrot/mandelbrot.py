@@ -14,11 +14,32 @@ from __future__ import print_function
 import numpy as np
 
 
+# Estimated peak working memory per pixel of a row band in mandelbrot_set,
+# excluding N: C and Z (complex64), the boolean mask, abs(Z) (float32) and the
+# fancy-indexed temporaries of the update step (4 x complex64)
+_WORKING_BYTES_PER_PIXEL = 2 * 8 + 1 + 4 + 4 * 8
+# Allowance for small, size-independent allocations (array headers, numpy
+# bookkeeping) made while computing a frame
+_FIXED_OVERHEAD_BYTES = 8 * 1024
+
+def iteration_dtype(maxiter):
+    """
+    Smallest unsigned integer dtype that can hold iteration counts up to
+    maxiter.
+    """
+    return np.min_scalar_type(max(int(maxiter), 0))
+
 def mandelbrot_set(xmin, xmax, ymin, ymax, xn, yn, maxiter, horizon=2.0):
     X = np.linspace(xmin, xmax, int(xn), dtype=np.float32)
     Y = np.linspace(ymin, ymax, int(yn), dtype=np.float32)
-    C = X + Y[:, None]*1j
-    N = np.zeros(C.shape, dtype=int)
+    return _mandelbrot_rows(X, Y, maxiter, horizon)
+
+def _mandelbrot_rows(X, Y, maxiter, horizon):
+    """
+    Mandelbrot iteration over the grid spanned by X and Y.
+    """
+    C = (X + Y[:, None]*1j).astype(np.complex64, copy=False)
+    N = np.zeros(C.shape, dtype=iteration_dtype(maxiter))
     Z = np.zeros(C.shape, np.complex64)
     for n in range(maxiter):
         I = np.less(abs(Z), horizon)
@@ -27,32 +48,121 @@ def mandelbrot_set(xmin, xmax, ymin, ymax, xn, yn, maxiter, horizon=2.0):
     N[N == maxiter-1] = 0
     return Z, N
 
-def renormalize_mandelbrot(Z, N, log_horizon):
+def renormalize_mandelbrot(Z, N, log_horizon, out=None):
     """
     Encapsulates normalization function from __main__
+
+    The normalization is computed in float32, in place in `out` (allocated
+    if not given), without any full-size temporaries.
     """
     # Normalized recount as explained in:
     # https://linas.org/art-gallery/escape/smooth.html
     # https://www.ibm.com/developerworks/community/blogs/jfp/entry/My_Christmas_Gift
-
-    # This line will generate warnings for null values but it is faster to
+    #   M = N + 1 - log(log(|Z|))/log(2) + log_horizon
+    if out is None: out = np.empty(N.shape, dtype=np.float32)
+    M = out
+    # These lines will generate warnings for null values but it is faster to
     # process them afterwards using the nan_to_num
-    with np.errstate(invalid='ignore'):
-        M = np.nan_to_num(N + 1 -
-                          np.log(np.log(abs(Z)))/np.log(2) +
-                          log_horizon)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        np.abs(Z, out=M)
+        np.log(M, out=M)
+        np.log(M, out=M)
+    M *= -1 / np.log(2)
+    M += N
+    M += 1 + log_horizon
+    np.nan_to_num(M, copy=False)
     return M
 
-def mandelbrot_image(xmin, xmax, ymin, ymax, xn, yn, maxiter, horizon=2.0):
+def mandelbrot_image(xmin, xmax, ymin, ymax, xn, yn, maxiter, horizon=2.0,
+                     max_bytes=None):
     """
     Helper-function combining mandelbrot_set and the normalization in __main__
     into one function that returns an array that can be directly visualized
     with imshow.
+
+    Returns a float32 array. If max_bytes is given, the peak memory used to
+    compute the frame (including the returned array) is kept below max_bytes
+    by computing the image in bands of rows. Raises ValueError if the budget
+    is too small to hold the output and a single row of working memory.
+
+    Note that without max_bytes the whole frame is iterated at once, and the
+    peak memory is dominated by the full-frame complex arrays and temporaries
+    of the iteration rather than by the output: most of the memory saving
+    requires setting a budget.
+    """
+    log_horizon = np.log(np.log(horizon))/np.log(2)
+    X = np.linspace(xmin, xmax, int(xn), dtype=np.float32)
+    Y = np.linspace(ymin, ymax, int(yn), dtype=np.float32)
+    M = np.empty((len(Y), len(X)), dtype=np.float32)
+    rows = band_rows(len(X), len(Y), maxiter, max_bytes)
+    for r0 in range(0, len(Y), rows):
+        Z, N = _mandelbrot_rows(X, Y[r0:r0+rows], maxiter, horizon)
+        renormalize_mandelbrot(Z, N, log_horizon, out=M[r0:r0+rows])
+    return M
+
+def band_rows(xn, yn, maxiter, max_bytes=None):
+    """
+    Number of rows per band such that computing an (yn, xn) image with
+    mandelbrot_image fits in max_bytes. All rows if max_bytes is None.
+    """
+    xn, yn = int(xn), int(yn)
+    if max_bytes is None: return max(yn, 1)
+    # float32 output image, X and Y grid coordinates and fixed overhead
+    out_bytes = 4 * xn * yn + 4 * (xn + yn) + _FIXED_OVERHEAD_BYTES
+    row_bytes = xn * (_WORKING_BYTES_PER_PIXEL +
+                      iteration_dtype(maxiter).itemsize)
+    rows = (int(max_bytes) - out_bytes) // max(row_bytes, 1)
+    if rows < 1:
+        raise ValueError("Memory budget of %d bytes is too small for a "
+                         "%d x %d image (need at least %d bytes)"
+                         %(max_bytes, xn, yn, out_bytes + row_bytes))
+    return min(rows, yn)
+
+def julia_set(c, xmin, xmax, ymin, ymax, xn, yn, maxiter, horizon=2.0):
+    """
+    Compute the Julia set for the complex parameter c.
+
+    Same iteration as mandelbrot_set, but with c fixed and the starting value
+    of z taken from the grid.
+    """
+    X = np.linspace(xmin, xmax, int(xn), dtype=np.float32)
+    Y = np.linspace(ymin, ymax, int(yn), dtype=np.float32)
+    Z = (X + Y[:, None]*1j).astype(np.complex64)
+    c = np.complex64(c)
+    N = np.zeros(Z.shape, dtype=iteration_dtype(maxiter))
+    for n in range(maxiter):
+        I = np.less(abs(Z), horizon)
+        N[I] = n
+        Z[I] = Z[I]**2 + c
+    N[N == maxiter-1] = 0
+    return Z, N
+
+def julia_image(c, xmin, xmax, ymin, ymax, xn, yn, maxiter, horizon=2.0):
+    """
+    Julia set counterpart of mandelbrot_image.
     """
     log_horizon = np.log(np.log(horizon))/np.log(2)
-    Z, N = mandelbrot_set(xmin, xmax, ymin, ymax, xn, yn, maxiter, horizon)
+    Z, N = julia_set(c, xmin, xmax, ymin, ymax, xn, yn, maxiter, horizon)
     return renormalize_mandelbrot(Z, N, log_horizon)
 
+def zoom_anchored(xlim, ylim, zoompoint, zoom_fraction, nsteps=1):
+    """
+    Return the (xlim, ylim) resulting from nsteps anchored zoom increments.
+
+    Each increment moves the center of the view zoom_fraction of the way
+    towards the zoompoint and shrinks the span by a factor of
+    (1 - zoom_fraction). The closed form allows any frame of a dive to be
+    computed independently of the previous ones.
+    """
+    xt, yt = zoompoint
+    scale = (1 - zoom_fraction) ** nsteps
+    limits = []
+    for (lo, hi), target in zip((xlim, ylim), (xt, yt)):
+        center, span = (lo + hi) / 2, (hi - lo) * scale
+        center = target - (target - center) * scale
+        limits.append((center - span / 2, center + span / 2))
+    return tuple(limits)
+
 if __name__ == '__main__':
     import time
     import matplotlib
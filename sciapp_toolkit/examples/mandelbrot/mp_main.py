@@ -1,14 +1,20 @@
 from __future__ import division
 import sys
+import time
 import numpy as np
-from PySide2 import QtCore, QtWidgets
+from collections import deque
+from PySide2 import QtCore, QtGui, QtWidgets
 from matplotlib import cm
 from multiprocessing import Pipe, Queue
 from queue import Empty as QueueEmpty
 
 from sciapp_toolkit.examples.mandelbrot.ui.ui_main import Ui_MainWindow
 from sciapp_toolkit.examples.mandelbrot.threads.MandelbrotComputeThread import MandelbrotThread
+from sciapp_toolkit.examples.mandelbrot.threads.JuliaPreviewThread import JuliaPreviewThread
+from sciapp_toolkit.examples.mandelbrot.ui.QMandelbrotVisualizer import QJuliaPreviewWidget
 from sciapp_toolkit.examples.mandelbrot.mandelbrot import mandelbrot_image
+from sciapp_toolkit.thread.profiling import (PROFILE_START, PROFILE_STOP,
+                                             dump_profiles)
 
 class ApplicationWindow(QtWidgets.QMainWindow, Ui_MainWindow):
     """
@@ -24,6 +30,21 @@ class ApplicationWindow(QtWidgets.QMainWindow, Ui_MainWindow):
         self._queue_timer_interval = 10   # Display queue check interval, ms
         self._zoom_frac_per_frame = 0.01  # Zoom-in fraction per frame when 
                                           # diving
+        self._profiling = False           # On-demand worker profiling state
+        self._profile_kind = None         # Profiler used in current session
+        self._profile_path = "mandelbrot_profile"  # Merged profile dump
+        self._profiles = []               # (kind, stats) received so far
+        self._profile_timeout = 5.0       # Max wait for worker profiles, s
+        self._profile_deadline = None     # Set while collecting profiles
+        self._profile_waiting = set()     # Workers yet to reply to STOP
+        self._julia_in_flight = False     # Preview request being computed
+        self._julia_sent = None           # (t_event, t_sent) of that request
+        self._julia_latest = None         # t_event of newest request sent
+        self._julia_pending = None        # Latest (c, t_event) received while
+                                          # a request is in flight
+        self._julia_request_timeout = 1.0 # Give up on a request after, s
+        self._julia_latency_budget = 0.05 # Target hover-to-display time, s
+        self.julia_latencies = deque(maxlen=100)  # Recent preview latencies
 
         # Initial bounds for the Mandelbrot computation - lifted directly
         # from the matplotlib example (see mandelbrot.py)
@@ -31,6 +52,8 @@ class ApplicationWindow(QtWidgets.QMainWindow, Ui_MainWindow):
         self.ymin, self.ymax, self.yn = -1.25, 1.25, 2500/2
         self.maxiter = 200
         self.horizon = 2.0
+        self.frame_memory_budget = 32 * 2**20  # Per-frame memory limit in
+                                               # bytes, per compute thread
 
         # Create pipes and queues for communicating with threads
         self.pipe_to_mandelbrot_thread, pipe_from_mandelbrot_thread = Pipe()
@@ -44,26 +67,63 @@ class ApplicationWindow(QtWidgets.QMainWindow, Ui_MainWindow):
                                                   self.xn, self.yn,
                                                   horizon=self.horizon,
                                                   inq=self.mandelbrot_queue,
-                                                  dispq=self.display_queue)
+                                                  dispq=self.display_queue,
+                                                  max_bytes=self.frame_memory_budget)
+
+        # Create low-priority Julia set preview thread with its own queues so
+        # that previews never wait behind Mandelbrot images
+        self.pipe_to_julia_thread, pipe_from_julia_thread = Pipe()
+        self.julia_display_queue = Queue()
+        self.julia_queue = Queue()
+        self.julia_thread = JuliaPreviewThread(pipe_from_julia_thread,
+                                               "julia_thread",
+                                               inq=self.julia_queue,
+                                               dispq=self.julia_display_queue)
+
+        # Control pipes of all workers - used for broadcasting profiling
+        # requests and collecting the results
+        self.worker_pipes = [self.pipe_to_mandelbrot_thread,
+                             self.pipe_to_julia_thread]
 
         # Set up the GUI
         self.setup_ui(self)
+        self.mpl_julia = QJuliaPreviewWidget(self.main_widget,
+                                             self.julia_thread.extent)
+        self.mpl_julia.setFixedHeight(250)
+        self.mpl_julia.latency_callback = self.record_julia_latency
+        self.main_widget.layout().insertWidget(1, self.mpl_julia)
         
         # Add a timer to initiate zooming of figure
         self.dive_timer = QtCore.QTimer()
         self.queue_check_timer = QtCore.QTimer()
 
+        # Keyboard shortcuts for toggling profiling of the worker threads,
+        # with cProfile or the low-overhead sampling profiler
+        self.profile_shortcut = QtWidgets.QShortcut(QtGui.QKeySequence("Ctrl+P"),
+                                                    self)
+        self.sample_profile_shortcut = QtWidgets.QShortcut(
+            QtGui.QKeySequence("Ctrl+Shift+P"), self)
+
         # Hook up events to callbacks
         self.dive_control_button.clicked.connect(self.toggle_dive)
         self.reset_button.clicked.connect(self.reset)
         self.dive_timer.timeout.connect(self.increment_zoom)
         self.queue_check_timer.timeout.connect(self.handle_display_queue_message)
+        self.queue_check_timer.timeout.connect(self.handle_profile_replies)
+        self.queue_check_timer.timeout.connect(self.handle_julia_queue_message)
+        self.mpl_mandelbrot.canvas.mpl_connect('motion_notify_event',
+                                               self.request_julia_preview)
+        self.profile_shortcut.activated.connect(
+            lambda: self.toggle_profiling("cprofile"))
+        self.sample_profile_shortcut.activated.connect(
+            lambda: self.toggle_profiling("sample"))
 
         # Compute initial mandelbrot set
         self.mandelbrot_ary = mandelbrot_image(self.xmin, self.xmax, 
                                                self.ymin, self.ymax, 
                                                self.xn, self.yn,
-                                               self.maxiter, self.horizon)
+                                               self.maxiter, self.horizon,
+                                               self.frame_memory_budget)
 
         # Set the image 
         self.mpl_mandelbrot.image = \
@@ -105,6 +165,152 @@ class ApplicationWindow(QtWidgets.QMainWindow, Ui_MainWindow):
                     self.request_mandelbrot_computation()
             except QueueEmpty: break
 
+    def request_julia_preview(self, mouse_event):
+        """
+        Request a Julia set preview for the c value under the cursor.
+
+        At most one request is outstanding at a time. Motion events received
+        while a preview is being computed only replace the pending request, so
+        a flood of events never queues up work for the preview thread.
+        """
+        if mouse_event.inaxes is not self.mpl_mandelbrot.axes: return
+        if not self.julia_thread.is_alive(): return
+        # Timestamp of the motion event - latency is measured from here, so it
+        # includes any time spent waiting behind the request in flight
+        t_event = time.time()
+        c = complex(mouse_event.xdata, mouse_event.ydata)
+        if self._julia_in_flight: self._julia_pending = (c, t_event)
+        else: self.send_julia_request(c, t_event)
+
+    def send_julia_request(self, c, t_event):
+        self.julia_queue.put((c, t_event))
+        self._julia_in_flight = True
+        self._julia_sent = (t_event, time.time())
+        self._julia_latest = t_event
+
+    def handle_julia_queue_message(self):
+        """
+        Display Julia set previews and dispatch the pending request, if any.
+        """
+        while True:
+            try:
+                origin, contents, data = self.julia_display_queue.get_nowait()
+            except QueueEmpty: break
+            ary, c, t_event, compute_time = data
+            # Reply superseded by a newer request. A late reply to the newest
+            # request (e.g. after a timeout) is still displayed
+            if t_event != self._julia_latest: continue
+            # Drawn, and latency recorded, at the next preview refresh
+            self.mpl_julia.update_image(ary, c, t_event, compute_time)
+            if self._julia_sent is not None and t_event == self._julia_sent[0]:
+                self._julia_in_flight = False
+                self._julia_sent = None
+        # Don't wait forever on a request the preview thread won't answer
+        if self._julia_in_flight:
+            if not self.julia_thread.is_alive():
+                self.statusBar().showMessage(
+                    "Julia preview thread exited (exit code %s)"
+                    %(self.julia_thread.exitcode))
+                self._julia_in_flight = False
+                self._julia_sent = None
+                self._julia_pending = None
+            elif time.time() - self._julia_sent[1] > self._julia_request_timeout:
+                self.statusBar().showMessage("Julia preview timed out", 2000)
+                self._julia_in_flight = False
+                self._julia_sent = None
+        if not self._julia_in_flight and self._julia_pending is not None:
+            self.send_julia_request(*self._julia_pending)
+            self._julia_pending = None
+
+    def record_julia_latency(self, latency, compute_time):
+        """
+        Record the latency, from mouse motion to preview drawn, of a Julia
+        set preview.
+        """
+        self.julia_latencies.append(latency)
+        if latency > self._julia_latency_budget:
+            self.statusBar().showMessage(
+                "Julia preview over budget: %.1f ms (compute %.1f ms)"
+                %(1e3 * latency, 1e3 * compute_time), 2000)
+
+    def julia_latency_stats(self):
+        """
+        Return (mean, 95th percentile, max) of recent Julia preview
+        latencies in seconds, or None if no previews have been displayed.
+        """
+        if len(self.julia_latencies) == 0: return None
+        lat = np.asarray(self.julia_latencies)
+        return lat.mean(), np.percentile(lat, 95), lat.max()
+
+    def toggle_profiling(self, kind="cprofile"):
+        """
+        Start or stop profiling in all worker threads.
+
+        kind selects the profiler ("cprofile" or "sample") when starting; it
+        is ignored when stopping. When profiling is stopped, each worker sends
+        its stats back on its control pipe. See handle_profile_replies.
+        A new session is refused until the previous one has been dumped.
+        """
+        if self._profiling:
+            for pipe in self.worker_pipes: pipe.send(PROFILE_STOP)
+            self._profiling = False
+            self._profile_waiting = set(range(len(self.worker_pipes)))
+            self._profile_deadline = time.time() + self._profile_timeout
+            self.statusBar().showMessage("Collecting worker profiles...")
+        elif self._profile_deadline is not None:
+            self.statusBar().showMessage("Still collecting worker profiles - "
+                                         "try again shortly")
+        else:
+            self._profiles = []
+            self._profile_kind = kind
+            msg = "%s:%s" %(PROFILE_START, kind)
+            for pipe in self.worker_pipes: pipe.send(msg)
+            self._profiling = True
+            self.statusBar().showMessage("Profiling workers with %s "
+                                         "(Ctrl+P to stop)" %(kind))
+
+    def handle_profile_replies(self, block=False):
+        """
+        Collect profiling results sent back on worker control pipes. Once all
+        workers have replied to PROFILE_STOP, or the collection times out,
+        dump the merged profile to disk.
+
+        If block is True, wait (up to the collection deadline) for the
+        outstanding replies instead of only handling those already received.
+        """
+        for i, pipe in enumerate(self.worker_pipes):
+            while pipe.poll(self._profile_poll_timeout(i, block)):
+                origin, contents, data = pipe.recv()
+                if contents == "profile":
+                    self._profiles.append(data)
+                    self._profile_waiting.discard(i)
+                elif contents == "profile_error":
+                    msg, reason = data
+                    self.statusBar().showMessage("%s: %s" %(origin, reason))
+                    if PROFILE_STOP in msg: self._profile_waiting.discard(i)
+        # Nothing being collected, or still waiting for replies
+        if self._profile_deadline is None: return
+        if self._profile_waiting and time.time() < self._profile_deadline:
+            return
+        written = []
+        if self._profiles:
+            written = dump_profiles(self._profiles, self._profile_path)
+        status = "Wrote %s" %(", ".join(written)) if written else \
+                 "No profiles collected"
+        if self._profile_waiting:
+            status += " (%d worker(s) did not reply)" %(len(self._profile_waiting))
+        self.statusBar().showMessage(status)
+        self._profiles = []
+        self._profile_waiting = set()
+        self._profile_deadline = None
+
+    def _profile_poll_timeout(self, i, block):
+        """
+        Time to wait for a message on the control pipe of worker i.
+        """
+        if not block or i not in self._profile_waiting: return 0
+        return max(0, self._profile_deadline - time.time())
+
     def request_mandelbrot_computation(self):
         """
         Send the necessary info to the mandelbrot_thread to initiate the
@@ -152,19 +358,37 @@ class ApplicationWindow(QtWidgets.QMainWindow, Ui_MainWindow):
         self.mandelbrot_thread.start()
         self.pipe_to_mandelbrot_thread.send("START")
         self.request_mandelbrot_computation()
+        # Kick off the Julia preview thread - idle until the mouse moves
+        self.julia_thread.start()
+        self.pipe_to_julia_thread.send("START")
 
     def closeEvent(self, event):
         """
         Override close event from QMainWindow to make sure threads are all
         appropriately cleaned up.
         """
-        # Stop the run loop in the mandelbrot thread
+        # Collect profiles before stopping the workers - a profiler still
+        # running at exit is discarded
+        if self._profiling:
+            self.toggle_profiling()
+        if self._profile_deadline is not None:
+            self.handle_profile_replies(block=True)
+        # Stop the run loop in the mandelbrot and julia threads
         self.pipe_to_mandelbrot_thread.send("STOP")
+        self.pipe_to_julia_thread.send("STOP")
         # Shutdown queues to allow underlying processes to join
         self.display_queue.close()
         self.mandelbrot_queue.close()
+        self.julia_display_queue.close()
+        self.julia_queue.close()
         # Join is blocking - waits for thread to exit nicely
         self.mandelbrot_thread.join()
+        self.julia_thread.join()
+        # Report preview latency
+        stats = self.julia_latency_stats()
+        if stats is not None:
+            print("Julia preview latency: mean %.1f ms, p95 %.1f ms, "
+                  "max %.1f ms" %tuple(1e3 * s for s in stats))
         # Once the compute thread is done, accept the original close event
         event.accept()
 
@@ -0,0 +1,143 @@
+"""
+Headless batch renderer for Mandelbrot dive animations.
+
+Renders the same anchored zoom sequence as the "diving" mode of the GUI
+applications, but without Qt or the dive timer. Frames are independent (see
+`zoom_anchored`), so they are distributed over a pool of worker processes
+which write each frame to disk as soon as it is computed.
+
+Example - 500 frames diving into the "seahorse valley":
+
+    python -m sciapp_toolkit.examples.mandelbrot.render_dive \\
+        --zoom-point -0.7435 0.1314 --zoom-rate 0.02 --frames 500 -o frames
+"""
+from __future__ import division, print_function
+import os
+import sys
+import time
+import argparse
+from multiprocessing import Pool, cpu_count
+
+import numpy as np
+from matplotlib.image import imsave
+
+from sciapp_toolkit.examples.mandelbrot.mandelbrot import (mandelbrot_image,
+                                                           band_rows,
+                                                           zoom_anchored)
+
+class DiveRenderer(object):
+    """
+    Picklable callable that renders and saves a single frame of a dive.
+    """
+    def __init__(self, extent, zoompoint, zoom_fraction, xn, yn, maxiter,
+                 horizon, outdir, fmt="png", cmap="plasma", max_bytes=None):
+        self.xlim, self.ylim = tuple(extent[:2]), tuple(extent[2:])
+        self.zoompoint = zoompoint
+        self.zoom_fraction = zoom_fraction
+        self.xn, self.yn = xn, yn
+        self.maxiter = maxiter
+        self.horizon = horizon
+        self.outdir = outdir
+        self.fmt = fmt
+        self.cmap = cmap
+        self.max_bytes = max_bytes
+
+    def frame_extent(self, frame):
+        """
+        Extent [xmin, xmax, ymin, ymax] of the given frame number.
+        """
+        xlim, ylim = zoom_anchored(self.xlim, self.ylim, self.zoompoint,
+                                   self.zoom_fraction, frame)
+        return [xlim[0], xlim[1], ylim[0], ylim[1]]
+
+    def __call__(self, frame):
+        """
+        Compute frame number `frame` and write it to outdir. Returns the
+        frame number.
+        """
+        xmin, xmax, ymin, ymax = self.frame_extent(frame)
+        ary = mandelbrot_image(xmin, xmax, ymin, ymax, self.xn, self.yn,
+                               self.maxiter, self.horizon, self.max_bytes)
+        # Same orientation as the GUI image
+        ary = np.flipud(ary)
+        fname = os.path.join(self.outdir, "frame_%06d.%s" %(frame, self.fmt))
+        if self.fmt == "npy": np.save(fname, ary)
+        else: imsave(fname, ary, cmap=self.cmap)
+        return frame
+
+def render_dive(renderer, nframes, processes=None, chunksize=1,
+                report_interval=1.0):
+    """
+    Render frames 0..nframes-1 with a pool of worker processes.
+
+    Progress and throughput are printed every report_interval seconds.
+    Returns the overall throughput in frames per second.
+    """
+    processes = processes or cpu_count()
+    tic = time.time()
+    last_report = tic
+    with Pool(processes) as pool:
+        # Frames are written by the workers - only frame numbers come back
+        for done, _ in enumerate(pool.imap_unordered(renderer, range(nframes),
+                                                     chunksize), 1):
+            now = time.time()
+            if now - last_report >= report_interval:
+                print("%d/%d frames, %.2f fps" %(done, nframes,
+                                                 done / (now - tic)))
+                last_report = now
+    elapsed = time.time() - tic
+    fps = nframes / elapsed if elapsed > 0 else float("inf")
+    print("Rendered %d frames in %.2f s with %d processes: %.2f fps"
+          %(nframes, elapsed, processes, fps))
+    return fps
+
+def main(argv=None):
+    # Defaults match the GUI applications (see main.py)
+    parser = argparse.ArgumentParser(
+        description="Render a Mandelbrot dive animation to disk without a GUI.")
+    parser.add_argument("--extent", type=float, nargs=4,
+                        default=[-2.25, 0.75, -1.25, 1.25],
+                        metavar=("XMIN", "XMAX", "YMIN", "YMAX"),
+                        help="Extent of the first frame")
+    parser.add_argument("--zoom-point", type=float, nargs=2, required=True,
+                        metavar=("X", "Y"), help="Anchor point of the zoom")
+    parser.add_argument("--zoom-rate", type=float, default=0.01,
+                        help="Zoom-in fraction per frame (default: 0.01)")
+    parser.add_argument("--frames", type=int, required=True,
+                        help="Number of frames to render")
+    parser.add_argument("--xn", type=int, default=1500,
+                        help="Frame width in pixels (default: 1500)")
+    parser.add_argument("--yn", type=int, default=1250,
+                        help="Frame height in pixels (default: 1250)")
+    parser.add_argument("--maxiter", type=int, default=200,
+                        help="Max number of iterations (default: 200)")
+    parser.add_argument("--horizon", type=float, default=2.0)
+    parser.add_argument("--cmap", default="plasma")
+    parser.add_argument("--format", choices=("png", "npy"), default="png",
+                        help="Frame file format. npy writes the raw "
+                             "normalized array (fastest)")
+    parser.add_argument("--max-mb", type=float, default=64,
+                        help="Per-frame, per-process memory budget in MB "
+                             "(default: 64). Increase for very large frames, "
+                             "or use 0 to disable the budget")
+    parser.add_argument("-o", "--outdir", default="dive_frames")
+    parser.add_argument("-j", "--processes", type=int, default=None,
+                        help="Number of worker processes (default: all cores)")
+    args = parser.parse_args(argv)
+
+    if not os.path.isdir(args.outdir): os.makedirs(args.outdir)
+    # A budget of 0 (or less) means unlimited
+    max_bytes = int(args.max_mb * 2**20) if args.max_mb > 0 else None
+    # Fail early, rather than in every worker, if the budget is too small
+    try:
+        band_rows(args.xn, args.yn, args.maxiter, max_bytes)
+    except ValueError as e:
+        parser.error(str(e))
+    renderer = DiveRenderer(args.extent, tuple(args.zoom_point),
+                            args.zoom_rate, args.xn, args.yn, args.maxiter,
+                            args.horizon, args.outdir, args.format, args.cmap,
+                            max_bytes)
+    render_dive(renderer, args.frames, args.processes)
+
+if __name__ == "__main__":
+    sys.exit(main())
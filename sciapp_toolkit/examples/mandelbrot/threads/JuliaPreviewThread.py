@@ -0,0 +1,67 @@
+from __future__ import print_function
+import os
+import time
+import numpy as np
+from queue import Empty as QueueEmpty
+
+from sciapp_toolkit.thread.ThreadWrapper import Thread
+from sciapp_toolkit.examples.mandelbrot.mandelbrot import julia_image
+
+class JuliaPreviewThread(Thread):
+    """
+    Low-priority thread for computing small Julia set previews.
+
+    Requests are (c, t_event) tuples on the input queue, where t_event is the
+    time of the mouse motion; it is passed back unchanged with the result.
+    Only the most recent request is computed: any requests that queued up
+    while the previous preview was being computed are discarded.
+    """
+    def __init__(self, inpipe, name, xn=160, yn=160,
+                 extent=(-1.6, 1.6, -1.6, 1.6), maxiter=100, horizon=2.0,
+                 niceness=10, inq=None, outq=None, dispq=None):
+        """
+        Thread for computing Julia set previews at a fixed resolution.
+        """
+        # Thread constructor
+        super(JuliaPreviewThread, self).__init__(inpipe, name, inq, outq,
+                                                 dispq)
+        # Params for Julia computation
+        self.xn = xn
+        self.yn = yn
+        self.extent = extent
+        self.maxiter = maxiter
+        self.horizon = horizon
+        # Scheduling priority increment, so that previews never compete with
+        # the main Mandelbrot computation for CPU time
+        self.niceness = niceness
+
+    def initialize(self):
+        super(JuliaPreviewThread, self).initialize()
+        # Lower the priority of this process (POSIX only)
+        if self.niceness and hasattr(os, "nice"):
+            os.nice(self.niceness)
+
+    def process_data(self):
+        """
+        Compute the Julia set preview for the latest requested c value.
+        """
+        # Latest wins: skip over any stale requests
+        while True:
+            try: self.data_in = self.input_queue.get_nowait()
+            except QueueEmpty: break
+        c, t_event = self.data_in
+        # Compute
+        tic = time.time()
+        xmin, xmax, ymin, ymax = self.extent
+        ary = julia_image(c, xmin, xmax, ymin, ymax, self.xn, self.yn,
+                          self.maxiter, self.horizon)
+        ary = np.flipud(ary)
+        compute_time = time.time() - tic
+        # Send result back to main thread, along with timing info for latency
+        # measurement
+        self.display_queue.put((self._name, "julia",
+                                (ary, c, t_event, compute_time)))
+
+    def cleanup(self):
+        self.display_queue.close()
+        self.input_queue.close()
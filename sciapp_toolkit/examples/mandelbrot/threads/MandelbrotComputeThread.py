@@ -12,9 +12,11 @@ class MandelbrotThread(Thread):
     Uses the function from the matplotlib example: see mandelbrot.py
     """
     def __init__(self, inpipe, name, xn, yn, maxiter=200, horizon=2.0,
-                 inq=None, outq=None, dispq=None):
+                 inq=None, outq=None, dispq=None, max_bytes=None):
         """
         Thread for computing the Mandelbrot set.
+
+        max_bytes is the per-frame memory budget, see mandelbrot_image.
         """
         # Thread constructor
         super(MandelbrotThread, self).__init__(inpipe, name, inq, outq, dispq)
@@ -23,6 +25,7 @@ class MandelbrotThread(Thread):
         self.yn = yn
         self.maxiter = maxiter
         self.horizon = horizon
+        self.max_bytes = max_bytes
 
     def process_data(self):
         """
@@ -33,7 +36,7 @@ class MandelbrotThread(Thread):
         xmin, xmax, ymin, ymax, self.maxiter = self.data_in
         # Recompute
         ary = mandelbrot_image(xmin, xmax, ymin, ymax, self.xn, self.yn,
-                               self.maxiter, self.horizon)
+                               self.maxiter, self.horizon, self.max_bytes)
         ary = np.flipud(ary)
         # Send result back to main thread
         self.display_queue.put((self._name, "mandelbrot", 
@@ -1,7 +1,11 @@
 from __future__ import print_function
+import time
 import numpy as np
+from matplotlib import cm
 
 from sciapp_toolkit.ui.QMPLWidget import QMPLWidget
+from sciapp_toolkit.ui.QMPLStreamingWidgets import QBlitMPLWidget
+from sciapp_toolkit.examples.mandelbrot.mandelbrot import zoom_anchored
 
 class QMandelbrotWidget(QMPLWidget):
     """
@@ -48,21 +52,75 @@ class QMandelbrotWidget(QMPLWidget):
         """
         # Zoom is anchored by the zoompoint
         if self.zoompoint is None: return
-        # Coordinates of target
-        xt, yt = self.zoompoint
-        # Current axes limits
-        xlim = self.axes.get_xlim()
-        ylim = self.axes.get_ylim()
-        # Determine central point and span of current axes
-        xspan, yspan = np.diff(xlim), np.diff(ylim)
-        xc, yc = xlim[0] + xspan / 2, ylim[0] + yspan / 2
-        # Compute new central point and span from anchor & scaling factor
-        xn = xc + (xt - xc) * zoom_fraction
-        yn = yc + (yt - yc) * zoom_fraction
-        xspan *= (1 - zoom_fraction)
-        yspan *= (1 - zoom_fraction)
+        xlim, ylim = zoom_anchored(self.axes.get_xlim(), self.axes.get_ylim(),
+                                   self.zoompoint, zoom_fraction)
         # Set axes limits
-        self.axes.set_xlim(xn - xspan / 2, xn + xspan / 2)
-        self.axes.set_ylim(yn - yspan / 2, yn + yspan / 2)
+        self.axes.set_xlim(*xlim)
+        self.axes.set_ylim(*ylim)
         # Update visualization
         self.canvas.draw()
+
+class QJuliaPreviewWidget(QBlitMPLWidget):
+    """
+    Small matplotlib-based widget for previewing the Julia set of the c value
+    under the cursor.
+
+    New previews are only drawn by the fixed-rate, blitted refresh of
+    QBlitMPLWidget, so a stream of previews never triggers full canvas
+    redraws on the GUI thread.
+    """
+    def __init__(self, parent=None, extent=(-1.6, 1.6, -1.6, 1.6),
+                 refresh_interval=50):
+        """
+        Create a QJuliaPreviewWidget, redrawn at most every refresh_interval
+        ms.
+        """
+        # QBlitMPLWidget constructor
+        super(QJuliaPreviewWidget, self).__init__(parent, refresh_interval)
+        self.extent = list(extent)
+        # Called with (latency, compute_time) once a preview has been drawn
+        self.latency_callback = None
+        self._pending = None
+        # Preview only - no navigation
+        self.mpl_toolbar.hide()
+        self.axes.set_xticks([])
+        self.axes.set_yticks([])
+        self.artist = self.axes.imshow(np.zeros((1, 1)), extent=self.extent,
+                                       cmap=cm.plasma, animated=True)
+        self.canvas.draw()
+
+    def update_image(self, image_ary, c, t_event=None, compute_time=None):
+        """
+        Queue a new Julia set image for parameter c for the next refresh.
+
+        t_event is the time of the mouse motion that requested the preview;
+        if given, the latency up to the preview being drawn is reported.
+        """
+        self._pending = (image_ary, c, t_event, compute_time)
+        self._dirty = True
+
+    def update_artist(self):
+        image_ary, c, _, _ = self._pending
+        self.artist.set_data(image_ary)
+        self.artist.autoscale()
+
+    def refresh(self):
+        """
+        Draw the latest queued preview and report its latency.
+        """
+        pending = self._pending if self._dirty else None
+        super(QJuliaPreviewWidget, self).refresh()
+        # Not drawn yet (e.g. background not cached)
+        if pending is None or self._dirty: return
+        image_ary, c, t_event, compute_time = pending
+        text = "c = %.4f %+.4fi" %(c.real, c.imag)
+        if t_event is not None:
+            latency = time.time() - t_event
+            text += "    latency: %.1f ms" %(1e3 * latency)
+            if self.latency_callback is not None:
+                self.latency_callback(latency, compute_time)
+        self.loc_label.setText(text)
+
+    def mouse_motion_callback(self, mouse_event):
+        # The location label is used to report c and the preview latency
+        pass
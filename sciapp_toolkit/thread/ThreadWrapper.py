@@ -4,6 +4,10 @@ import os
 from multiprocessing import Process, Queue, Pipe
 from queue import Empty as QueueEmpty
 
+from sciapp_toolkit.thread.profiling import (PROFILE_START, PROFILE_STOP,
+                                             parse_profile_start,
+                                             make_profiler)
+
 class Thread(Process):
     """
     Processing 'thread' with I/O and runloop based on multiprocessing.Process
@@ -27,6 +31,8 @@ class Thread(Process):
         self.output_queue = outq
         self.display_queue = dispq
         self.in_pipe = inpipe
+        # On-demand profiling
+        self._profiler = None
         # Containers for data/messages
         self.message_list = []
         self.data_in = None
@@ -40,13 +46,57 @@ class Thread(Process):
         """
         while self.in_pipe.poll():
             msg = self.in_pipe.recv()
-            # Handle standard control messages here
-            if   "STOP"  in msg: self._abort = True
+            # Handle standard control messages here. Profiling messages are
+            # checked first as they contain the START/STOP substrings
+            if   PROFILE_START in msg: self.start_profiling(msg)
+            elif PROFILE_STOP  in msg: self.stop_profiling()
+            elif "STOP"  in msg: self._abort = True
             elif "PAUSE" in msg: self._paused = True
             elif "START" in msg: self._paused = False
             # Non-standard message - append to list for subsequent action
             else: self.message_list.append(msg)
 
+    def start_profiling(self, msg=PROFILE_START):
+        """
+        Start profiling the run loop with the profiler requested in msg.
+
+        See sciapp_toolkit.thread.profiling for the supported profilers.
+        If the request is rejected, an error is sent back on the control pipe:
+        (name, "profile_error", (msg, reason)).
+        """
+        if self._profiler is not None:
+            self.in_pipe.send((self._name, "profile_error",
+                               (msg, "already profiling")))
+            return
+        try:
+            kind = parse_profile_start(msg)
+        except ValueError as e:
+            self.in_pipe.send((self._name, "profile_error", (msg, str(e))))
+            return
+        self._profiler = make_profiler(kind)
+        self._profiler.start()
+        if self._verbose: print("%s: %s profiling started" %(self._name, kind))
+
+    def stop_profiling(self):
+        """
+        Stop profiling and send the collected stats back on the control pipe.
+
+        The reply has the same (origin, contents, data) layout as messages
+        on the display queue: (name, "profile", (kind, stats)). If the thread
+        is not profiling, the reply is
+        (name, "profile_error", (PROFILE_STOP, reason)) instead, so that
+        every PROFILE_STOP gets an answer.
+        """
+        if self._profiler is None:
+            self.in_pipe.send((self._name, "profile_error",
+                               (PROFILE_STOP, "not profiling")))
+            return
+        kind = self._profiler.kind
+        stats = self._profiler.stop()
+        self._profiler = None
+        self.in_pipe.send((self._name, "profile", (kind, stats)))
+        if self._verbose: print("%s: %s profiling stopped" %(self._name, kind))
+
     def poll_data_queue(self):
         """
         Extract and notify of new data in input queue.
@@ -118,6 +168,11 @@ class Thread(Process):
             self.poll_data_queue()
             if self._newdata:
                 self.process_data()
-        # Once out of run loop, clean up
+        # Once out of run loop, clean up. Stats of a profiler still running
+        # are discarded: nobody is listening on the control pipe any more, and
+        # sending a large reply could block the process from exiting
+        if self._profiler is not None:
+            self._profiler.stop()
+            self._profiler = None
         self.cleanup()
 
@@ -0,0 +1,251 @@
+"""
+On-demand profiling of running `ThreadWrapper.Thread` workers.
+
+Two profilers are supported:
+ - "cprofile": deterministic profiling with the standard library `cProfile`.
+   Accurate call counts, but adds appreciable overhead to every function
+   call.
+ - "sample": a low-overhead statistical profiler that periodically records
+   the stack of the worker run loop. Results are stored as collapsed
+   ("folded") stacks, compatible with flamegraph tools.
+
+Profilers are started/stopped from the parent process by sending the
+standard control messages `PROFILE_START` (optionally `PROFILE_START:sample`)
+and `PROFILE_STOP` down the control pipe of a worker. On `PROFILE_STOP`, the
+worker replies on the same pipe with `(name, "profile", (kind, stats))`.
+Rejected requests (e.g. an unknown profiler kind, or PROFILE_STOP when not
+profiling) are answered with `(name, "profile_error", (msg, reason))`.
+Profilers still running when a worker stops are discarded without a reply.
+
+Stats collected from several workers can be merged and written to disk with
+`dump_profiles`. Profiles written to disk can be merged and summarized from
+the command line:
+
+    python -m sciapp_toolkit.thread.profiling worker1.prof worker2.prof
+"""
+from __future__ import division, print_function
+import os
+import sys
+import signal
+import cProfile
+import pstats
+import threading
+from collections import Counter
+
+PROFILE_START = "PROFILE_START"
+PROFILE_STOP = "PROFILE_STOP"
+PROFILER_KINDS = ("cprofile", "sample")
+
+class CProfiler(object):
+    """
+    Thin wrapper around cProfile.Profile with a picklable result.
+    """
+    kind = "cprofile"
+    def __init__(self):
+        self._profile = cProfile.Profile()
+
+    def start(self):
+        self._profile.enable()
+
+    def stop(self):
+        """
+        Stop profiling and return the raw stats dictionary.
+        """
+        self._profile.disable()
+        self._profile.create_stats()
+        return self._profile.stats
+
+class StackSampler(object):
+    """
+    Statistical profiler that samples the stack of a single thread.
+
+    Where available (POSIX), samples are driven by a SIGPROF interval timer,
+    so the stack is recorded wherever the profiled thread is spending CPU
+    time. Otherwise samples are taken every `interval` seconds from a daemon
+    thread. Note that the threaded sampler can only acquire the GIL when the
+    profiled thread releases it, so its results are biased towards blocking
+    calls.
+    """
+    kind = "sample"
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.counts = Counter()
+        self._target_ident = None
+        self._sampler = None
+        self._prev_handler = None
+        self._stop_event = threading.Event()
+
+    def start(self):
+        """
+        Start sampling the stack of the calling thread.
+        """
+        self._target_ident = threading.get_ident()
+        use_signal = (hasattr(signal, "setitimer") and
+                      threading.current_thread() is threading.main_thread())
+        if use_signal:
+            self._prev_handler = signal.signal(signal.SIGPROF,
+                                               self._signal_handler)
+            signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+        else:
+            self._stop_event.clear()
+            self._sampler = threading.Thread(target=self._sample_loop,
+                                             name="StackSampler")
+            self._sampler.daemon = True
+            self._sampler.start()
+
+    def stop(self):
+        """
+        Stop sampling and return a dict mapping collapsed stacks to counts.
+        """
+        if self._sampler is not None:
+            self._stop_event.set()
+            self._sampler.join()
+            self._sampler = None
+        else:
+            signal.setitimer(signal.ITIMER_PROF, 0, 0)
+            signal.signal(signal.SIGPROF, self._prev_handler)
+        return dict(self.counts)
+
+    def _record(self, frame):
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append("%s:%s:%d" %(os.path.basename(code.co_filename),
+                                      code.co_name, frame.f_lineno))
+            frame = frame.f_back
+        self.counts[";".join(reversed(stack))] += 1
+
+    def _signal_handler(self, signum, frame):
+        self._record(frame)
+
+    def _sample_loop(self):
+        while not self._stop_event.wait(self.interval):
+            frame = sys._current_frames().get(self._target_ident)
+            if frame is not None: self._record(frame)
+
+def parse_profile_start(msg):
+    """
+    Return the profiler kind requested by a PROFILE_START message.
+
+    The kind is given after a colon, e.g. "PROFILE_START:sample". Defaults to
+    "cprofile".
+    """
+    _, _, kind = msg.partition(":")
+    kind = kind.strip() or "cprofile"
+    if kind not in PROFILER_KINDS:
+        raise ValueError("Unknown profiler kind '%s', expected one of %s"
+                         %(kind, PROFILER_KINDS))
+    return kind
+
+def make_profiler(kind):
+    """
+    Create a profiler instance of the given kind.
+    """
+    if kind == "sample": return StackSampler()
+    return CProfiler()
+
+class _StatsHolder(object):
+    """
+    Duck-typed stand-in for a Profile object, so that raw stats dictionaries
+    received from workers can be loaded by pstats.Stats.
+    """
+    def __init__(self, stats):
+        self.stats = stats
+
+    def create_stats(self):
+        pass
+
+def merge_cprofile_stats(stats_list):
+    """
+    Merge raw cProfile stats dictionaries into a single pstats.Stats object.
+    """
+    merged = None
+    for stats in stats_list:
+        if merged is None: merged = pstats.Stats(_StatsHolder(stats))
+        else: merged.add(_StatsHolder(stats))
+    return merged
+
+def merge_sample_stats(stats_list):
+    """
+    Merge collapsed-stack sample counts by summing counts per stack.
+    """
+    merged = Counter()
+    for stats in stats_list:
+        merged.update(stats)
+    return merged
+
+def dump_profiles(profiles, path):
+    """
+    Merge profiles from several workers and write them to `path`.
+
+    `profiles` is an iterable of `(kind, stats)` tuples as sent back by
+    workers on PROFILE_STOP. cProfile results are written to `path` + ".prof"
+    in the standard pstats format; sampled results are written to `path` +
+    ".folded" as collapsed stacks. Returns the list of files written.
+    """
+    by_kind = {}
+    for kind, stats in profiles:
+        by_kind.setdefault(kind, []).append(stats)
+    written = []
+    if by_kind.get("cprofile"):
+        fname = path + ".prof"
+        merge_cprofile_stats(by_kind["cprofile"]).dump_stats(fname)
+        written.append(fname)
+    if by_kind.get("sample"):
+        fname = path + ".folded"
+        write_folded(merge_sample_stats(by_kind["sample"]), fname)
+        written.append(fname)
+    return written
+
+def write_folded(counts, fname):
+    with open(fname, "w") as fh:
+        for stack, count in sorted(counts.items()):
+            fh.write("%s %d\n" %(stack, count))
+
+def read_folded(fname):
+    counts = Counter()
+    with open(fname, "r") as fh:
+        for line in fh:
+            stack, _, count = line.rstrip("\n").rpartition(" ")
+            if stack: counts[stack] += int(count)
+    return counts
+
+def main(argv=None):
+    """
+    Merge profile dumps from several workers and print a summary.
+    """
+    import argparse
+    parser = argparse.ArgumentParser(
+        description="Merge and summarize worker profiles. Files ending in "
+                    ".folded are treated as sampled stacks, all others as "
+                    "pstats dumps.")
+    parser.add_argument("files", nargs="+", help="Profile dumps to merge")
+    parser.add_argument("-o", "--output", default=None,
+                        help="Write merged profile(s) to OUTPUT[.prof|.folded]")
+    parser.add_argument("-s", "--sort", default="cumulative",
+                        help="pstats sort key (default: cumulative)")
+    parser.add_argument("-n", "--limit", type=int, default=25,
+                        help="Number of entries to print (default: 25)")
+    args = parser.parse_args(argv)
+
+    folded = [f for f in args.files if f.endswith(".folded")]
+    prof = [f for f in args.files if not f.endswith(".folded")]
+    if prof:
+        stats = pstats.Stats(*prof)
+        stats.sort_stats(args.sort).print_stats(args.limit)
+        if args.output is not None: stats.dump_stats(args.output + ".prof")
+    if folded:
+        counts = merge_sample_stats(read_folded(f) for f in folded)
+        total = sum(counts.values())
+        # Summarize by leaf frame (self time)
+        leaves = Counter()
+        for stack, count in counts.items():
+            leaves[stack.rsplit(";", 1)[-1]] += count
+        print("%d samples" %(total))
+        for leaf, count in leaves.most_common(args.limit):
+            print("%6.2f%%  %s" %(100 * count / total, leaf))
+        if args.output is not None:
+            write_folded(counts, args.output + ".folded")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,341 @@
+"""
+QMPLWidget-based widgets for visualizing high-rate streaming data.
+
+Data is appended to a preallocated rolling buffer at whatever rate it arrives.
+Rendering is decoupled from the input: a timer redraws the view at a fixed
+frame rate, reducing the buffer to (at most) one min/max pair per horizontal
+pixel and blitting only the animated artist over a cached background. The
+per-frame cost therefore depends on the size of the widget, not on the input
+rate.
+"""
+from __future__ import division
+import numpy as np
+
+from PySide2 import QtCore
+
+from sciapp_toolkit.ui.QMPLWidget import QMPLWidget
+
+class RingBuffer(object):
+    """
+    Fixed-capacity rolling buffer backed by a preallocated numpy array.
+
+    Every element is stored twice (at slot i and i + capacity) so that the
+    most recent elements are always available as a contiguous view without
+    copying.
+    """
+    def __init__(self, capacity, shape=(), dtype=np.float64):
+        self.capacity = int(capacity)
+        self._data = np.zeros((2 * self.capacity,) + tuple(shape), dtype=dtype)
+        self._index = 0     # Next slot to write, in [0, capacity)
+        self.count = 0      # Number of valid elements
+        self.total = 0      # Number of elements ever appended
+
+    def extend(self, values):
+        """
+        Append values to the buffer, overwriting the oldest elements.
+        """
+        values = np.asarray(values, dtype=self._data.dtype)
+        n = len(values)
+        if n == 0: return
+        self.total += n
+        # Only the last `capacity` values can be retained
+        if n > self.capacity:
+            values = values[-self.capacity:]
+            n = self.capacity
+        cap, i = self.capacity, self._index
+        head = min(n, cap - i)
+        self._data[i:i+head] = values[:head]
+        self._data[i+cap:i+cap+head] = values[:head]
+        if head < n:
+            tail = n - head
+            self._data[:tail] = values[head:]
+            self._data[cap:cap+tail] = values[head:]
+        self._index = (i + n) % cap
+        self.count = min(self.count + n, cap)
+
+    def latest(self, n=None):
+        """
+        Return a view of the n most recent elements, oldest first.
+        """
+        n = self.count if n is None else min(n, self.count)
+        end = self._index + self.capacity
+        return self._data[end-n:end]
+
+    def clear(self):
+        self._index = 0
+        self.count = 0
+        self.total = 0
+
+def minmax_decimate(data, spp, out_min=None, out_max=None, partial=0):
+    """
+    Reduce 1D data to the min and max of each consecutive group of spp
+    samples.
+
+    The `partial` newest samples are left out of the full groups and reduced
+    to a final, partial group. Passing partial = total % spp, where total is
+    the number of samples ever appended, ties the group boundaries to the
+    absolute sample count, so appending data does not change which samples
+    fall into the existing groups. Leftover samples at the *start* of data
+    that do not fill a complete group are dropped.
+    Optionally write into preallocated out_min/out_max arrays.
+    """
+    partial = min(partial, len(data))
+    full = data[:len(data) - partial]
+    nfull = len(full) // spp
+    blocks = full[len(full) - nfull * spp:].reshape(nfull, spp)
+    n = nfull + (1 if partial else 0)
+    if out_min is None: out_min = np.empty(n, dtype=data.dtype)
+    if out_max is None: out_max = np.empty(n, dtype=data.dtype)
+    out_min, out_max = out_min[:n], out_max[:n]
+    np.min(blocks, axis=1, out=out_min[:nfull])
+    np.max(blocks, axis=1, out=out_max[:nfull])
+    if partial:
+        out_min[nfull] = data[-partial:].min()
+        out_max[nfull] = data[-partial:].max()
+    return out_min, out_max
+
+class QBlitMPLWidget(QMPLWidget):
+    """
+    QMPLWidget with a fixed-rate, blitted refresh of a single animated artist.
+
+    Subclasses set self.artist and implement update_artist.
+    """
+    def __init__(self, parent=None, refresh_interval=33, **kwargs):
+        """
+        Create a QBlitMPLWidget, redrawn every refresh_interval ms.
+        """
+        super(QBlitMPLWidget, self).__init__(parent, **kwargs)
+        self.artist = None
+        self._background = None
+        self._dirty = False
+        self._needs_full_redraw = False
+        # Re-cache background whenever the full canvas is redrawn (e.g. on
+        # resize or when axes limits are changed)
+        self.canvas.mpl_connect('draw_event', self.draw_callback)
+        # Fixed-rate refresh, independent of data rate
+        self.refresh_timer = QtCore.QTimer()
+        self.refresh_timer.timeout.connect(self.refresh)
+        self.refresh_timer.start(refresh_interval)
+
+    def draw_callback(self, draw_event):
+        """
+        Cache the axes background and draw the animated artist on top.
+        """
+        self._background = self.canvas.copy_from_bbox(self.axes.bbox)
+        if self.artist is not None:
+            self.axes.draw_artist(self.artist)
+
+    def axes_width_px(self):
+        """
+        Width of the axes in display pixels.
+        """
+        return max(1, int(self.axes.bbox.width))
+
+    def update_artist(self):
+        """
+        Update the animated artist from the buffered data.
+
+        Must be implemented in derived class.
+        """
+        raise NotImplementedError
+
+    def refresh(self):
+        """
+        Redraw the animated artist if new data has arrived since the last
+        frame.
+        """
+        if not self._dirty or self._background is None: return
+        self._dirty = False
+        self.update_artist()
+        # Changes to axes/colour limits require a full redraw; the background
+        # is re-cached in draw_callback
+        if self._needs_full_redraw:
+            self._needs_full_redraw = False
+            self.canvas.draw()
+            return
+        self.canvas.restore_region(self._background)
+        self.axes.draw_artist(self.artist)
+        self.canvas.blit(self.axes.bbox)
+
+class QStreamingLineWidget(QBlitMPLWidget):
+    """
+    Rolling time-series view of a high-rate 1D stream.
+
+    The x-axis shows time relative to the newest sample, in units of
+    1 / sample_rate.
+    """
+    def __init__(self, parent=None, capacity=1000000, sample_rate=1.0,
+                 ylim=None, refresh_interval=33, dtype=np.float32, **kwargs):
+        """
+        Create a QStreamingLineWidget holding the last `capacity` samples.
+
+        If ylim is None, the y-axis follows the data: it expands as soon as
+        data falls outside of it, and shrinks once the data has occupied less
+        than half of it for about a second.
+        """
+        super(QStreamingLineWidget, self).__init__(parent, refresh_interval,
+                                                   **kwargs)
+        self.sample_rate = sample_rate
+        self.buffer = RingBuffer(capacity, dtype=dtype)
+        self._autoscale = ylim is None
+        self._shrink_fraction = 0.5     # Shrink when data spans less than this
+                                        # fraction of the y-range...
+        self._shrink_delay = 30         # ...for this many consecutive frames
+        self._shrink_count = 0
+        # Decimation outputs, (re)allocated when the axes width changes
+        self._npix = 0
+        self._ymin = self._ymax = self._xs = self._ys = None
+
+        self.artist, = self.axes.plot([], [], lw=1, animated=True)
+        self.axes.set_xlim(-capacity / sample_rate, 0)
+        self.axes.set_ylim(*(ylim if ylim is not None else (-1, 1)))
+        self.canvas.draw()
+
+    def append(self, samples):
+        """
+        Append new samples to the rolling buffer. Cheap: no rendering is done
+        until the next refresh.
+        """
+        self.buffer.extend(samples)
+        self._dirty = True
+
+    def clear(self):
+        self.buffer.clear()
+        self._dirty = True
+
+    def _allocate(self, npix):
+        self._npix = npix
+        # One extra column for the partially filled, newest pixel
+        self._ymin = np.empty(npix + 1, dtype=self.buffer._data.dtype)
+        self._ymax = np.empty(npix + 1, dtype=self.buffer._data.dtype)
+        self._xs = np.empty(2 * (npix + 1))
+        self._ys = np.empty(2 * (npix + 1), dtype=self.buffer._data.dtype)
+
+    def update_artist(self):
+        """
+        Decimate the buffer to one min/max pair per pixel and update the line.
+        """
+        npix = self.axes_width_px()
+        if npix != self._npix: self._allocate(npix)
+        spp = max(1, -(-self.buffer.capacity // npix))   # Samples per pixel
+        data = self.buffer.latest()
+        # Pixel columns are aligned to the absolute sample count so that they
+        # do not shimmer as data is appended
+        partial = self.buffer.total % spp
+        ymin, ymax = minmax_decimate(data, spp, self._ymin, self._ymax,
+                                     partial)
+        k = len(ymin)
+        nfull = k - (1 if partial else 0)
+        # Interleave min/max so each pixel column is drawn as a vertical
+        # segment, placed at the time of the newest sample in the column
+        xs, ys = self._xs[:2*k], self._ys[:2*k]
+        xs[0:2*nfull:2] = -(partial + spp * np.arange(nfull - 1, -1, -1))
+        if partial: xs[-2] = 0
+        xs[0::2] /= self.sample_rate
+        xs[1::2] = xs[0::2]
+        ys[0::2] = ymin
+        ys[1::2] = ymax
+        self.artist.set_data(xs, ys)
+        if self._autoscale and k > 0:
+            self.autoscale_y(ymin.min(), ymax.max())
+
+    def autoscale_y(self, lo, hi):
+        """
+        Fit the y-axis (with a 10% margin) to the data range [lo, hi].
+
+        The axis expands immediately if data falls outside of it. It only
+        shrinks once the data has spanned less than _shrink_fraction of it
+        for _shrink_delay consecutive frames, so that the view does not
+        jitter and a transient spike does not flatten it forever.
+        """
+        cur_lo, cur_hi = self.axes.get_ylim()
+        # Floor the span relative to the data magnitude, so that a flat
+        # signal (e.g. an idle channel or DC offset) keeps a sensible range
+        margin = 0.1 * max(hi - lo, 1e-3 * max(abs(lo), abs(hi), 1))
+        new_lo, new_hi = lo - margin, hi + margin
+        if lo < cur_lo or hi > cur_hi:
+            self._shrink_count = 0
+            self.axes.set_ylim(min(new_lo, cur_lo), max(new_hi, cur_hi))
+            self._needs_full_redraw = True
+        elif new_hi - new_lo < self._shrink_fraction * (cur_hi - cur_lo):
+            self._shrink_count += 1
+            if self._shrink_count >= self._shrink_delay:
+                self._shrink_count = 0
+                self.axes.set_ylim(new_lo, new_hi)
+                self._needs_full_redraw = True
+        else: self._shrink_count = 0
+
+class QWaterfallWidget(QBlitMPLWidget):
+    """
+    Rolling waterfall (spectrogram-style) view of a stream of 1D rows.
+
+    Each appended row (e.g. a spectrum) becomes one line of the image; the
+    newest row is at the top. Columns are reduced to at most one per pixel by
+    taking the maximum, so narrow peaks remain visible.
+    """
+    def __init__(self, parent=None, nrows=500, ncols=1024, extent=None,
+                 clim=None, cmap="viridis", refresh_interval=33,
+                 dtype=np.float32, **kwargs):
+        """
+        Create a QWaterfallWidget holding the last `nrows` rows of length
+        `ncols`.
+
+        If clim is None, the colour limits follow the data.
+        """
+        super(QWaterfallWidget, self).__init__(parent, refresh_interval,
+                                               **kwargs)
+        self.ncols = ncols
+        self.buffer = RingBuffer(nrows, shape=(ncols,), dtype=dtype)
+        self._autoscale = clim is None
+        self._npix = 0
+        self._edges = None
+        self._image = None
+
+        extent = extent if extent is not None else [0, ncols, -nrows, 0]
+        self.artist = self.axes.imshow(np.zeros((nrows, 1), dtype=dtype),
+                                       extent=extent, aspect="auto",
+                                       origin="lower", cmap=cmap,
+                                       interpolation="nearest",
+                                       animated=True)
+        self.artist.set_clim(*(clim if clim is not None else (0, 1)))
+        self.canvas.draw()
+
+    def append(self, rows):
+        """
+        Append one row, or a (k, ncols) block of rows, to the rolling buffer.
+        """
+        rows = np.asarray(rows)
+        if rows.ndim == 1: rows = rows[None, :]
+        self.buffer.extend(rows)
+        self._dirty = True
+
+    def clear(self):
+        self.buffer.clear()
+        self._npix = 0      # Force reallocation of (zeroed) image
+        self._dirty = True
+
+    def _allocate(self, npix):
+        self._npix = npix
+        if self.ncols > npix:
+            self._edges = np.linspace(0, self.ncols, npix + 1).astype(int)[:-1]
+        else:
+            self._edges = None
+        self._image = np.zeros((self.buffer.capacity, min(npix, self.ncols)),
+                               dtype=self.buffer._data.dtype)
+
+    def update_artist(self):
+        """
+        Decimate columns of the buffered rows to the axes width and update
+        the image.
+        """
+        npix = self.axes_width_px()
+        if npix != self._npix: self._allocate(npix)
+        rows = self.buffer.latest()
+        # Rows not yet filled stay at the bottom (oldest) of the image
+        out = self._image[self.buffer.capacity - len(rows):]
+        if self._edges is None: out[...] = rows
+        else: np.maximum.reduceat(rows, self._edges, axis=1, out=out)
+        self.artist.set_data(self._image)
+        if self._autoscale and len(rows) > 0:
+            lo, hi = out.min(), out.max()
+            if hi > lo: self.artist.set_clim(lo, hi)